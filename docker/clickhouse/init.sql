@@ -5,6 +5,7 @@ CREATE TABLE IF NOT EXISTS event_log
     `environment` String,
     `event_context` String,
     `metadata_version` Int32 DEFAULT 1,
+    `batch_id` String DEFAULT '',
 )
 ENGINE = MergeTree()
 PARTITION BY toYYYYMM(event_date_time)
@@ -1,10 +1,39 @@
 from __future__ import absolute_import
 from celery import Celery
+from celery.signals import worker_init
 from django.conf import settings
 import os
+from typing import Any
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 app = Celery('core')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+
+# Outbox processing is I/O-bound (Postgres + ClickHouse), so workers should not
+# hoard prefetched tasks while blocked on the network. Run the dedicated worker with:
+#   celery -A core worker -Q outbox -Ofair --pool=gevent --concurrency=50 --prefetch-multiplier=1
+# -Ofair only hands a task to a child that is ready to run it, so a long outbox batch
+# (up to soft_time_limit) never queues other batches behind it; it composes with the
+# prefetch multiplier below.
+app.conf.worker_prefetch_multiplier = 1
+app.conf.task_acks_late = True
+app.conf.broker_connection_retry_on_startup = True
+
+app.autodiscover_tasks()
+
+
+@worker_init.connect
+def patch_psycopg_for_gevent(**kwargs: Any) -> None:  # noqa: ARG001, ANN401
+    """
+    Under --pool=gevent the sockets are monkey-patched, but psycopg2 talks to Postgres
+    through libpq and would block the whole event loop. Make it yield to other greenlets.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return
+
+    if monkey.is_module_patched('socket'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -1,10 +1,17 @@
+import json
 import re
+import threading
+import uuid
 from collections.abc import Generator
 from contextlib import contextmanager
 from typing import Any
 
 import clickhouse_connect
+import orjson
+import pyarrow as pa
 import structlog
+from celery.signals import worker_process_init, worker_process_shutdown
+from clickhouse_connect.driver import httputil
 from clickhouse_connect.driver.exceptions import DatabaseError
 from django.conf import settings
 from django.utils import timezone
@@ -19,6 +26,75 @@ EVENT_LOG_COLUMNS = [
     'environment',
     'event_context',
 ]
+OUTBOX_LOG_SCHEMA = pa.schema([
+    ('event_type', pa.string()),
+    ('event_date_time', pa.timestamp('us', tz='UTC')),
+    ('environment', pa.string()),
+    ('event_context', pa.binary()),
+    ('metadata_version', pa.int32()),
+    ('batch_id', pa.string()),
+])
+
+# Batches smaller than this are buffered and coalesced server-side (async_insert)
+# instead of each creating its own MergeTree part
+ASYNC_INSERT_MAX_ROWS = 1000
+ASYNC_INSERT_SETTINGS = {
+    'async_insert': 1,
+    'wait_for_async_insert': 1,  # Keep the insert synchronous for the caller
+    'async_insert_busy_timeout_ms': 1000,
+    'async_insert_max_data_size': 10_000_000,
+}
+
+_client: clickhouse_connect.driver.Client | None = None
+# Guards the client creation: it does a network round-trip, during which other threads/greenlets
+# would also see no client and build their own (threading.Lock is patched by gevent)
+_client_lock = threading.Lock()
+
+
+def get_client() -> clickhouse_connect.driver.Client:
+    """Returns the process-wide ClickHouse client, creating it on first use.
+
+    The client is shared across tasks, so HTTP connections are kept alive in
+    its pool instead of being re-established for every batch.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = clickhouse_connect.get_client(
+                    host=settings.CLICKHOUSE_HOST,
+                    port=settings.CLICKHOUSE_PORT,
+                    user=settings.CLICKHOUSE_USER,
+                    password=settings.CLICKHOUSE_PASSWORD,
+                    query_retries=2,
+                    connect_timeout=30,
+                    # A full outbox batch is a single request, give it time to be sent
+                    send_receive_timeout=60,
+                    # Compress request bodies: JSON-heavy event_context shrinks several times with lz4
+                    compress=settings.CLICKHOUSE_COMPRESSION,
+                    # Session ids forbid concurrent queries, and the client is shared between greenlets/threads
+                    autogenerate_session_id=False,
+                    pool_mgr=httputil.get_pool_manager(maxsize=settings.CLICKHOUSE_POOL_SIZE),
+                )
+    return _client
+
+
+def close_client() -> None:
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+@worker_process_init.connect
+def _init_worker_client(**kwargs: Any) -> None:  # noqa: ARG001, ANN401
+    get_client()
+
+
+@worker_process_shutdown.connect
+def _close_worker_client(**kwargs: Any) -> None:  # noqa: ARG001, ANN401
+    close_client()
 
 
 class EventLogClient:
@@ -28,21 +104,11 @@ class EventLogClient:
     @classmethod
     @contextmanager
     def init(cls) -> Generator['EventLogClient']:
-        client = clickhouse_connect.get_client(
-            host=settings.CLICKHOUSE_HOST,
-            port=settings.CLICKHOUSE_PORT,
-            user=settings.CLICKHOUSE_USER,
-            password=settings.CLICKHOUSE_PASSWORD,
-            query_retries=2,
-            connect_timeout=30,
-            send_receive_timeout=10,
-        )
+        client = get_client()
         try:
             yield cls(client)
         except Exception as e:
             logger.error('error while executing clickhouse query', error=str(e))
-        finally:
-            client.close()
 
     def insert(
         self,
@@ -58,6 +124,21 @@ class EventLogClient:
         except DatabaseError as e:
             logger.error('unable to insert data to clickhouse', error=str(e))
 
+    def insert_outbox(self, logs: list[dict[str, Any]], batch_id: uuid.UUID) -> None:
+        """Inserts a batch of outbox logs (``Outbox`` rows fetched with
+        ``.values()``) in a single request as an Arrow table. Every row is
+        tagged with the id of the OutboxBatch it was sent in. Small batches use
+        ClickHouse async inserts, still waiting for the data to be written.
+
+        Errors are not swallowed: the caller decides whether the batch failed.
+        """
+        self._client.insert_arrow(
+            table=settings.CLICKHOUSE_EVENT_LOG_TABLE_NAME,
+            arrow_table=self._convert_outbox(logs, batch_id),
+            database=settings.CLICKHOUSE_SCHEMA,
+            settings=ASYNC_INSERT_SETTINGS if len(logs) < ASYNC_INSERT_MAX_ROWS else None,
+        )
+
     def query(self, query: str) -> Any:  # noqa: ANN401
         logger.debug('executing clickhouse query', query=query)
 
@@ -78,6 +159,29 @@ class EventLogClient:
             for event in data
         ]
 
+    def _convert_outbox(self, logs: list[dict[str, Any]], batch_id: uuid.UUID) -> pa.Table:
+        event_types, event_date_times, environments, event_contexts, metadata_versions = [], [], [], [], []
+        for log in logs:
+            event_types.append(self._to_snake_case(log['event_type']))
+            event_date_times.append(log['event_date_time'])
+            environments.append(log['environment'])
+            event_contexts.append(self._dump_json(log['event_context']))
+            metadata_versions.append(log['metadata_version'])
+
+        batch_ids = [str(batch_id)] * len(logs)
+        columns = [event_types, event_date_times, environments, event_contexts, metadata_versions, batch_ids]
+        return pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, OUTBOX_LOG_SCHEMA, strict=True)],
+            schema=OUTBOX_LOG_SCHEMA,
+        )
+
+    def _dump_json(self, value: Any) -> bytes:  # noqa: ANN401
+        try:
+            return orjson.dumps(value)
+        except orjson.JSONEncodeError:
+            # orjson rejects what jsonb accepts (e.g. integers beyond 64 bits), one such row must not fail the batch
+            return json.dumps(value).encode()
+
     def _to_snake_case(self, event_name: str) -> str:
         result = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', event_name)
         return re.sub('([a-z0-9])([A-Z])', r'\1_\2', result).lower()
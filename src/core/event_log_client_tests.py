@@ -0,0 +1,22 @@
+import json
+import uuid
+
+from django.utils import timezone
+
+from core.event_log_client import EventLogClient
+
+
+def test_convert_outbox_falls_back_for_oversized_integers() -> None:
+    event_context = {'n': 2**70}
+    log = {
+        'id': 1,
+        'event_type': 'TestEvent',
+        'event_date_time': timezone.now(),
+        'environment': 'test',
+        'event_context': event_context,
+        'metadata_version': 1,
+    }
+
+    table = EventLogClient(client=None)._convert_outbox([log], batch_id=uuid.uuid4())
+
+    assert json.loads(table.column('event_context')[0].as_py()) == event_context
@@ -77,6 +77,14 @@ CLICKHOUSE_URI = (
     f'{CLICKHOUSE_PROTOCOL}'
 )
 CLICKHOUSE_EVENT_LOG_TABLE_NAME = 'event_log'
+# Size of the shared client's HTTP connection pool; keep in line with the outbox worker concurrency
+CLICKHOUSE_POOL_SIZE = env.int('CLICKHOUSE_POOL_SIZE', default=50)
+CLICKHOUSE_COMPRESSION = env('CLICKHOUSE_COMPRESSION', default='lz4')
+
+# Maximum number of outbox records sent to ClickHouse in a single insert
+OUTBOX_BATCH_SIZE = env.int('OUTBOX_BATCH_SIZE', default=10_000)
+# Number of parallel process_outbox_shard tasks spawned per schedule tick
+OUTBOX_NUM_SHARDS = env.int('OUTBOX_NUM_SHARDS', default=8)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -110,6 +118,14 @@ STATIC_ROOT = env("STATIC_ROOT")
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Shared between all processes, so cache-based guards (e.g. the outbox stale sweep) hold across workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env('CACHE_URL', default='redis://localhost:6379/1'),
+    },
+}
+
 CELERY_BROKER = env("CELERY_BROKER", default="redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = env("CELERY_RESULT_BACKEND", default="redis://localhost:6379/0")
 CELERY_ALWAYS_EAGER = env("CELERY_ALWAYS_EAGER", default=DEBUG)
@@ -188,8 +204,8 @@ if SENTRY_SETTINGS.get("dsn") and not DEBUG:
 
 
 CELERY_BEAT_SCHEDULE = {
-    'cleanup-outboxes-every-60-minutes': {
+    'process-outbox-every-10-seconds': {
         'task': 'users.tasks.process_outbox',
-        'schedule': 60 * 4,
+        'schedule': 10,
     },
 }
@@ -1,3 +1,7 @@
+import datetime as dt
+import functools
+import types
+from collections.abc import Mapping
 from typing import Any, Dict, Optional, Protocol
 import structlog
 from django.db import transaction
@@ -7,6 +11,15 @@ from users.models import Outbox
 
 logger = structlog.get_logger(__name__)
 
+
+@functools.cache
+def _default_context_vars(use_case_class: type) -> Mapping[str, Any]:
+    # Built once per use case class instead of on every execute() call; read-only since it is shared
+    return types.MappingProxyType({
+        'use_case': use_case_class.__name__,
+    })
+
+
 class UseCaseRequest(Model):
     pass
 
@@ -23,44 +36,75 @@ class UseCase(Protocol):
         ):
             return self._execute(request)
 
-    def _get_context_vars(self, request: UseCaseRequest) -> dict[str, Any]:  # noqa: ARG002
+    def _get_context_vars(self, request: UseCaseRequest) -> Mapping[str, Any]:  # noqa: ARG002
         """
         !!! WARNING:
             This method is calling out of transaction so do not make db
             queries in this method.
         """
-        return {
-            'use_case': self.__class__.__name__,
-        }
+        return _default_context_vars(self.__class__)
 
     @transaction.atomic()
     def _execute(self, request: UseCaseRequest) -> UseCaseResponse:
         raise NotImplementedError()
 
 
-def log_event(event_type: str, event_context: dict[str, Any], environment: str) -> Optional[Outbox]:
+def log_event(
+    event_type: str,
+    event_context: dict[str, Any],
+    environment: str,
+    event_date_time: dt.datetime | None = None,
+) -> Optional[Outbox]:
     """Логирует событие в Outbox в рамках атомарной транзакции.
 
     Args:
         event_type (str): Тип события.
         event_context (dict[str, Any]): Контекст события (произвольные данные).
         environment (str): Среда выполнения.
+        event_date_time (Optional[datetime]): Время события. Позволяет вызывающему коду,
+            логирующему пачку событий, вычислить время один раз; по умолчанию текущее время.
 
     Returns:
         Optional[Outbox]: Объект Outbox, если успешно создан, иначе None.
     """
+    log_entries = log_events_bulk([(event_type, event_context, environment)], event_date_time=event_date_time)
+    return log_entries[0] if log_entries else None
+
+
+def log_events_bulk(
+    events: list[tuple[str, dict[str, Any], str]],
+    event_date_time: dt.datetime | None = None,
+) -> list[Outbox]:
+    """Логирует пачку событий в Outbox одним bulk_create в рамках атомарной транзакции.
+
+    Args:
+        events (list[tuple[str, dict[str, Any], str]]): События в виде кортежей
+            (тип события, контекст события, среда выполнения).
+        event_date_time (Optional[datetime]): Время событий; по умолчанию текущее время.
+
+    Returns:
+        list[Outbox]: Созданные объекты Outbox, либо пустой список при ошибке.
+    """
+    now = timezone.now()  # Вычисляем время один раз для всей пачки
+    # Без явного времени event_date_time заполняется значением по умолчанию на стороне БД
+    extra_fields = {'event_date_time': event_date_time} if event_date_time else {}
+    log_entries = [
+        Outbox(
+            event_type=event_type,
+            environment=environment,
+            event_context=event_context,
+            metadata_version=1,
+            status=Outbox.STATUS_PENDING,  # Устанавливаем статус "ожидание обработки"
+            created_at=now,
+            **extra_fields,
+        )
+        for event_type, event_context, environment in events
+    ]
+
     try:
         with transaction.atomic():
-            log_entry = Outbox.objects.create(
-                event_type=event_type,
-                event_date_time=timezone.now(),
-                environment=environment,
-                event_context=event_context,
-                metadata_version=1,
-                status=Outbox.STATUS_PENDING  # Устанавливаем статус "ожидание обработки"
-            )
-            return log_entry
+            return Outbox.objects.bulk_create(log_entries, batch_size=1000)
 
     except Exception as e:
-        logger.error("Failed to log event", error=str(e), event_type=event_type)
-        return None
\ No newline at end of file
+        logger.error("Failed to log events", error=str(e), size=len(events))
+        return []
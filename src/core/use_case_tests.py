@@ -0,0 +1,54 @@
+import datetime as dt
+
+import pytest
+from django.utils import timezone
+
+from core.use_case import log_event, log_events_bulk
+from users.models import Outbox
+
+pytestmark = [pytest.mark.django_db]
+
+
+def test_log_events_bulk_creates_all_events() -> None:
+    events = [(f'TestEvent{i}', {'data': f'test{i}'}, 'test') for i in range(5)]
+
+    log_entries = log_events_bulk(events)
+
+    assert len(log_entries) == 5
+    assert list(
+        Outbox.objects.order_by('id').values_list('event_type', 'event_context', 'environment', 'status'),
+    ) == [
+        (f'TestEvent{i}', {'data': f'test{i}'}, 'test', Outbox.STATUS_PENDING)
+        for i in range(5)
+    ]
+
+
+def test_log_events_bulk_returns_db_default_event_date_time() -> None:
+    before = timezone.now()
+
+    log_entries = log_events_bulk([('TestEvent', {}, 'test')])
+
+    # event_date_time is filled by the database default and returned by the INSERT
+    assert isinstance(log_entries[0].event_date_time, dt.datetime)
+    assert log_entries[0].event_date_time >= before
+
+
+def test_log_events_bulk_uses_explicit_event_date_time() -> None:
+    event_date_time = timezone.now() - dt.timedelta(days=1)
+
+    log_entries = log_events_bulk(
+        [('TestEvent1', {}, 'test'), ('TestEvent2', {}, 'test')],
+        event_date_time=event_date_time,
+    )
+
+    assert [log.event_date_time for log in log_entries] == [event_date_time, event_date_time]
+    assert set(Outbox.objects.values_list('event_date_time', flat=True)) == {event_date_time}
+
+
+def test_log_event_returns_created_entry() -> None:
+    log_entry = log_event('TestEvent', {'data': 'test'}, 'test')
+
+    assert log_entry == Outbox.objects.get()
+    assert log_entry.event_type == 'TestEvent'
+    assert log_entry.event_context == {'data': 'test'}
+    assert log_entry.status == Outbox.STATUS_PENDING
@@ -1,18 +1,27 @@
+from collections.abc import Generator
+from datetime import timedelta
+
 import pytest
 from django.utils import timezone
-from users.models import Outbox
-from users.tasks import process_outbox
+from users.models import Outbox, OutboxBatch
+from users.tasks import process_outbox_shard, sweep_stale
 from core.event_log_client import EventLogClient
 import json
+from unittest import mock
 
-@pytest.fixture(autouse=True)
-def setup_clickhouse():
+@pytest.fixture(scope='session')
+def _ch_schema() -> None:
+    # DDL is needed only once per test session
     with EventLogClient.init() as client:
         client._client.command(
             "CREATE TABLE IF NOT EXISTS default.event_logs_test "
-            "(event_type String, event_date_time DateTime, environment String, event_context String, metadata_version UInt64) "
+            "(event_type String, event_date_time DateTime, environment String, event_context String, "
+            "metadata_version UInt64, batch_id String DEFAULT '') "
             "ENGINE = MergeTree() ORDER BY (event_date_time)"
         )
+
+@pytest.fixture(autouse=True)
+def setup_clickhouse(_ch_schema: None) -> Generator:
     yield
     with EventLogClient.init() as client:
         client._client.command("TRUNCATE TABLE default.event_logs_test")
@@ -28,7 +37,7 @@ def test_outbox_processing():
             metadata_version=1
         )
 
-    process_outbox()
+    process_outbox_shard(0, 1)
 
     # Проверка статусов
     assert Outbox.objects.filter(status=Outbox.STATUS_PROCESSED).count() == 3
@@ -50,7 +59,7 @@ def test_retry_failed_events():
         metadata_version=1
     )
 
-    process_outbox()
+    process_outbox_shard(0, 1)
     log.refresh_from_db()
 
     # Проверка статуса
@@ -64,4 +73,112 @@ def test_retry_failed_events():
         )
         assert len(result) == 1
 
+@pytest.mark.django_db
+def test_inserted_batch_is_not_reinserted() -> None:
+    # Пачка уже отправлена в ClickHouse, но статусы в Postgres не обновились
+    log = Outbox.objects.create(
+        event_type='TestRetry',
+        environment='test',
+        event_context={'retry': 'test'},
+        status=Outbox.STATUS_PROCESSING,
+        metadata_version=1,
+    )
+    batch = OutboxBatch.objects.create(outbox_ids=[log.id], status=OutboxBatch.STATUS_INSERTED)
+
+    with mock.patch.object(EventLogClient, 'insert_outbox') as insert_outbox:
+        process_outbox_shard(0, 1, batch_id=str(batch.id))
+
+    # Повторной вставки в ClickHouse нет
+    insert_outbox.assert_not_called()
+    log.refresh_from_db()
+    assert log.status == Outbox.STATUS_PROCESSED
+    assert not OutboxBatch.objects.exists()
+
+@pytest.mark.django_db
+def test_transient_error_retries_same_batch() -> None:
+    log = Outbox.objects.create(
+        event_type='TestTransient',
+        environment='test',
+        event_context={'transient': 'test'},
+        metadata_version=1,
+    )
+
+    # Первая вставка падает с сетевой ошибкой, повтор проходит через Task.retry
+    with mock.patch.object(
+        EventLogClient, 'insert_outbox', side_effect=[ConnectionError('clickhouse is down'), None],
+    ) as insert_outbox:
+        process_outbox_shard.apply(args=(0, 1))
+
+    # Повтор вставляет ту же пачку
+    assert insert_outbox.call_count == 2
+    first_call, retry_call = insert_outbox.call_args_list
+    assert first_call.kwargs['batch_id'] == retry_call.kwargs['batch_id']
+    assert [row['id'] for row in retry_call.args[0]] == [log.id]
+
+    log.refresh_from_db()
+    assert log.status == Outbox.STATUS_PROCESSED
+    assert not OutboxBatch.objects.exists()
+
+
+def create_processing_log(updated_ago: timedelta = timedelta()) -> Outbox:
+    log = Outbox.objects.create(
+        event_type='TestStale',
+        environment='test',
+        event_context={'stale': 'test'},
+        status=Outbox.STATUS_PROCESSING,
+        metadata_version=1,
+    )
+    # QuerySet.update() не трогает auto_now, так запись можно «состарить»
+    Outbox.objects.filter(id=log.id).update(updated_at=timezone.now() - updated_ago)
+    return log
+
+@pytest.mark.django_db
+def test_sweep_stale_processes_abandoned_inserted_batch() -> None:
+    log = create_processing_log()
+    OutboxBatch.objects.create(
+        outbox_ids=[log.id],
+        status=OutboxBatch.STATUS_INSERTED,
+        created_at=timezone.now() - timedelta(hours=2),
+    )
+
+    sweep_stale(timezone.now())
+
+    # Записи уже в ClickHouse, повторно их не отправляем
+    log.refresh_from_db()
+    assert log.status == Outbox.STATUS_PROCESSED
+    assert not OutboxBatch.objects.exists()
+
+@pytest.mark.django_db
+def test_sweep_stale_fails_abandoned_pending_batch() -> None:
+    log = create_processing_log()
+    OutboxBatch.objects.create(outbox_ids=[log.id], created_at=timezone.now() - timedelta(hours=2))
+
+    sweep_stale(timezone.now())
+
+    log.refresh_from_db()
+    assert log.status == Outbox.STATUS_FAILED
+    assert not OutboxBatch.objects.exists()
+
+@pytest.mark.django_db
+def test_sweep_stale_keeps_live_batch() -> None:
+    # Запись старше 10 минут, но её пачка ещё обрабатывается
+    log = create_processing_log(updated_ago=timedelta(minutes=20))
+    batch = OutboxBatch.objects.create(outbox_ids=[log.id])
+
+    sweep_stale(timezone.now())
+
+    log.refresh_from_db()
+    assert log.status == Outbox.STATUS_PROCESSING
+    assert OutboxBatch.objects.filter(id=batch.id).exists()
+
+@pytest.mark.django_db
+def test_sweep_stale_fails_orphan_processing_record() -> None:
+    stale_log = create_processing_log(updated_ago=timedelta(minutes=20))
+    fresh_log = create_processing_log()
+
+    sweep_stale(timezone.now())
 
+    stale_log.refresh_from_db()
+    fresh_log.refresh_from_db()
+    assert stale_log.status == Outbox.STATUS_FAILED
+    assert fresh_log.status == Outbox.STATUS_PROCESSING
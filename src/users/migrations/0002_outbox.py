@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-15 12:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Outbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('event_type', models.CharField(max_length=255)),
+                ('event_date_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('environment', models.CharField(max_length=255)),
+                ('event_context', models.JSONField()),
+                ('metadata_version', models.PositiveIntegerField(default=1)),
+                ('status', models.CharField(
+                    choices=[
+                        ('pending', 'Pending'), ('processing', 'Processing'),
+                        ('processed', 'Processed'), ('failed', 'Failed'),
+                    ],
+                    db_index=True, default='pending', max_length=20,
+                )),
+            ],
+            options={
+                'indexes': [
+                    models.Index(
+                        condition=models.Q(('status__in', ['pending', 'failed'])),
+                        fields=['created_at'], include=('id',), name='outbox_pending_idx',
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-15 12:00
+
+import uuid
+
+import django.contrib.postgres.fields
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxBatch',
+            fields=[
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('outbox_ids', django.contrib.postgres.fields.ArrayField(
+                    base_field=models.BigIntegerField(), size=None,
+                )),
+                ('status', models.CharField(
+                    choices=[('pending', 'Pending'), ('inserted', 'Inserted')], default='pending', max_length=20,
+                )),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-15 12:00
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_outboxbatch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outbox',
+            name='event_date_time',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now()),
+        ),
+    ]
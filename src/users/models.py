@@ -1,7 +1,8 @@
-import json
+import uuid
 from django.contrib.auth.models import AbstractBaseUser
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
-from django.utils import timezone
+from django.db.models.functions import Now
 from core.models import TimeStampedModel
 from django.core.exceptions import ValidationError
 
@@ -38,9 +39,10 @@ class Outbox(TimeStampedModel):
         (STATUS_PROCESSED, 'Processed'),
         (STATUS_FAILED, 'Failed'),
     ]
+    _VALID_STATUSES = frozenset(status for status, _ in STATUS_CHOICES)
 
     event_type = models.CharField(max_length=255)
-    event_date_time = models.DateTimeField(default=timezone.now)
+    event_date_time = models.DateTimeField(db_default=Now())
     environment = models.CharField(max_length=255)
     event_context = models.JSONField()
     metadata_version = models.PositiveIntegerField(default=1)
@@ -48,14 +50,38 @@ class Outbox(TimeStampedModel):
 
     class Meta:
         indexes = [
-            models.Index(fields=['status', 'created_at']),
+            # Partial covering index for the pending/failed selection: skips processed rows
+            # and serves the created_at ordering and id-based shard filter from the index.
+            models.Index(
+                fields=['created_at'],
+                include=['id'],
+                name='outbox_pending_idx',
+                condition=models.Q(status__in=['pending', 'failed']),
+            ),
         ]
 
     def __str__(self):
         return f"{self.event_type} ({self.status})"
 
     def clean(self):
-        if self.status not in dict(self.STATUS_CHOICES):
+        if self.status not in self._VALID_STATUSES:
             raise ValidationError(f"Invalid status: {self.status}")
-        if len(self.event_type) > 255:
-            raise ValidationError("Слишком длинный event_type")
\ No newline at end of file
+
+
+class OutboxBatch(TimeStampedModel):
+    """A batch of Outbox records sent to ClickHouse, used to make retries idempotent."""
+
+    STATUS_PENDING = 'pending'
+    STATUS_INSERTED = 'inserted'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_INSERTED, 'Inserted'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    outbox_ids = ArrayField(models.BigIntegerField())
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+
+    def __str__(self) -> str:
+        return f"{self.id} ({self.status})"
@@ -1,89 +1,299 @@
-from celery import shared_task
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any
+from celery import Task, shared_task
+from clickhouse_connect.driver.exceptions import OperationalError as ClickHouseOperationalError
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
-from datetime import timedelta
-from django.db import transaction
-from users.models import Outbox
-from core.event_log_client import EventLogClient
+from datetime import datetime, timedelta
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from users.models import Outbox, OutboxBatch
+from core.event_log_client import EventLogClient, get_client
 import structlog
 from sentry_sdk import capture_message, start_transaction
 
 # Logger for structured logging
 logger = structlog.get_logger(__name__)
 
+# Cache key guarding the stale-records sweep so it runs at most once per interval across all workers
+STALE_SWEEP_CACHE_KEY = 'outbox_stale_sweep'
+STALE_SWEEP_INTERVAL = 60  # seconds
+# Records left in 'processing' outside of any batch for this long are considered stale
+STALE_RECORD_AGE = timedelta(minutes=10)
+# A batch older than this is abandoned by its task (worker killed or retries exhausted). It must exceed
+# the whole retry window: 4 attempts of up to 330s plus 60 + 120 + 240s of backoff (~29 minutes).
+STALE_BATCH_AGE = timedelta(minutes=60)
+
+# Outbox fields fetched for the ClickHouse insert; rows are loaded as dicts, not model instances
+OUTBOX_LOG_FIELDS = ('id', 'event_type', 'event_date_time', 'environment', 'event_context', 'metadata_version')
+
+# Transient errors worth retrying; any other error is a logical one and fails the batch right away
+RETRYABLE_ERRORS = (ConnectionError, OperationalError, ClickHouseOperationalError)
+
+# First key of the two-key Postgres advisory lock, so shard locks do not clash with other lock users
+OUTBOX_LOCK_NAMESPACE = 0x0B0C5
+
+
+@contextmanager
+def advisory_lock(key: int) -> Generator[bool]:
+    """
+    Tries to take a session-level Postgres advisory lock without waiting.
+    Yields True if the lock was acquired (and releases it on exit), False otherwise.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [OUTBOX_LOCK_NAMESPACE, key])
+        acquired = cursor.fetchone()[0]
+
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [OUTBOX_LOCK_NAMESPACE, key])
+
+
+def set_status(ids: list[int], status: str) -> None:
+    """
+    Updates the status of the given outbox records in a single statement. The ids
+    are sent as one array parameter instead of a growing `id IN (...)` list.
+    """
+    table = connection.ops.quote_name(Outbox._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET status = %s, updated_at = NOW() '  # noqa: S608
+            f'FROM unnest(%s::bigint[]) AS t(id) WHERE {table}.id = t.id',
+            [status, ids],
+        )
+
+
+def sweep_stale(now: datetime) -> None:
+    """
+    Releases records stuck in 'processing'. Records of a live batch are left to the
+    task owning it; abandoned batches are resolved and deleted: records of an inserted
+    batch are already in ClickHouse and become 'processed', the others become 'failed'.
+    """
+    outbox_table = connection.ops.quote_name(Outbox._meta.db_table)
+    batch_table = connection.ops.quote_name(OutboxBatch._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {outbox_table} SET updated_at = NOW(), '  # noqa: S608
+            f'status = CASE WHEN b.status = %s THEN %s ELSE %s END '
+            f'FROM {batch_table} AS b, unnest(b.outbox_ids) AS t(id) '
+            f'WHERE {outbox_table}.id = t.id AND {outbox_table}.status = %s AND b.created_at <= %s',
+            [
+                OutboxBatch.STATUS_INSERTED, Outbox.STATUS_PROCESSED, Outbox.STATUS_FAILED,
+                Outbox.STATUS_PROCESSING, now - STALE_BATCH_AGE,
+            ],
+        )
+        cursor.execute(
+            f'UPDATE {outbox_table} SET status = %s, updated_at = NOW() '  # noqa: S608
+            f'WHERE status = %s AND updated_at <= %s AND NOT EXISTS ('
+            f'SELECT 1 FROM {batch_table} AS b WHERE {outbox_table}.id = ANY(b.outbox_ids))',
+            [Outbox.STATUS_FAILED, Outbox.STATUS_PROCESSING, now - STALE_RECORD_AGE],
+        )
+    OutboxBatch.objects.filter(created_at__lte=now - STALE_BATCH_AGE).delete()
+
+
+def claim_batch(shard_id: int, num_shards: int) -> tuple[OutboxBatch | None, list[dict[str, Any]]]:
+    """
+    Selects pending and failed logs of the shard, marks them as 'processing' and
+    records them in a new OutboxBatch, all in one short transaction.
+    Returns (None, []) if there is nothing to process.
+    """
+    now = timezone.now()  # Computed once and reused for the whole batch
+
+    with transaction.atomic():
+        # Handling stale records (only one worker per interval wins the cache key)
+        if cache.add(STALE_SWEEP_CACHE_KEY, 1, STALE_SWEEP_INTERVAL):
+            sweep_stale(now)
+
+        # Select and lock records for processing (pending or failed), skipping rows locked by other workers
+        pending_logs = list(Outbox.objects.select_for_update(skip_locked=True).annotate(
+            shard=F('id') % num_shards,
+        ).filter(
+            shard=shard_id,
+            status__in=[Outbox.STATUS_PENDING, Outbox.STATUS_FAILED],
+        ).order_by('created_at').values(
+            *OUTBOX_LOG_FIELDS,
+        )[:settings.OUTBOX_BATCH_SIZE])  # Limit the number of records processed at once
+
+        if not pending_logs:
+            return None, []
+
+        # Claim the records, so other workers skip them once the locks are released
+        pending_logs_ids = [log['id'] for log in pending_logs]
+        set_status(pending_logs_ids, Outbox.STATUS_PROCESSING)
+        batch = OutboxBatch.objects.create(outbox_ids=pending_logs_ids, created_at=now)
+
+    return batch, pending_logs
+
+
+def release_batch(batch: OutboxBatch, status: str) -> None:
+    """Sets the final status of the batch records and deletes the batch, in one transaction."""
+    with transaction.atomic():
+        set_status(batch.outbox_ids, status)
+        OutboxBatch.objects.filter(id=batch.id).delete()
+
+
+def insert_and_release(batch: OutboxBatch, pending_logs: list[dict[str, Any]]) -> None:
+    """
+    Inserts the batch into ClickHouse in a background thread while the 'processed'
+    status update runs in Postgres, so the batch takes max(CH, PG) instead of their sum.
+    The update and the batch deletion commit only once the ClickHouse insert has succeeded.
+    """
+    client = EventLogClient(get_client())
+    # Only the ClickHouse insert leaves the current thread: Django database connections are per-thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # 3. Insert logs into ClickHouse (external service for storing logs)
+        insert = executor.submit(client.insert_outbox, pending_logs, batch_id=batch.id)
+        try:
+            with transaction.atomic():
+                # 4. Mark logs as 'processed' and drop the batch, committed only if the insert succeeds
+                set_status(batch.outbox_ids, Outbox.STATUS_PROCESSED)
+                insert.result()
+                OutboxBatch.objects.filter(id=batch.id).delete()
+        except Exception:
+            # The rows are in ClickHouse but the commit failed: flag the batch, so a retry never inserts it twice
+            if insert.exception() is None:
+                OutboxBatch.objects.filter(id=batch.id).update(status=OutboxBatch.STATUS_INSERTED)
+            raise
+
+
+def complete_batch(batch: OutboxBatch, pending_logs: list[dict[str, Any]] | None) -> None:
+    """
+    Inserts the batch into ClickHouse, unless a previous attempt already did, and
+    marks its logs as processed. The logs are re-read from the database when not passed.
+    """
+    if batch.status == OutboxBatch.STATUS_INSERTED:
+        logger.info("Batch already inserted, skipping ClickHouse insert")
+        # 4. Mark logs as 'processed' and drop the batch
+        release_batch(batch, Outbox.STATUS_PROCESSED)
+        return
+
+    if pending_logs is None:
+        # Retry: re-read the records, skipping any that no longer belong to this batch
+        pending_logs = list(Outbox.objects.filter(
+            id__in=batch.outbox_ids,
+            status=Outbox.STATUS_PROCESSING,
+        ).values(*OUTBOX_LOG_FIELDS))
+
+    insert_and_release(batch, pending_logs)
+
+
+@shared_task(queue='outbox')
+def process_outbox() -> None:
+    """
+    Fans the outbox queue out to OUTBOX_NUM_SHARDS parallel tasks, each one
+    owning the records whose id falls into its shard (id % num_shards).
+    """
+    num_shards = settings.OUTBOX_NUM_SHARDS
+    for shard_id in range(num_shards):
+        process_outbox_shard.delay(shard_id, num_shards)
+
+
 @shared_task(
-    autoretry_for=(Exception,),  # Automatically retry the task in case of failure
+    bind=True,
+    queue='outbox',  # Routed to the dedicated I/O-bound outbox worker
+    autoretry_for=RETRYABLE_ERRORS,  # Automatically retry the task on transient failures
     retry_backoff=60,  # Retry delay, increases with each retry
     max_retries=3,  # Maximum number of retries before giving up
     soft_time_limit=300,  # Soft time limit in seconds, after which the task should be considered slow
     time_limit=330  # Hard time limit in seconds, after which the task is terminated
 )
-def process_outbox() -> None:
+def process_outbox_shard(self: Task, shard_id: int, num_shards: int, batch_id: str | None = None) -> None:
     """
-    Processes the outbox queue, updating the status of the messages and
-    inserting them into ClickHouse. Handles pending and failed messages.
-    The task retries on failure and logs all operations.
+    Processes one shard of the outbox queue, inserting pending and failed
+    messages into ClickHouse and marking them as processed. A shard already
+    being worked on (advisory lock held) is skipped. The selected rows are
+    locked with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never
+    pick the same messages. The task retries on transient failures and logs all operations.
+
+    Every batch is recorded as an OutboxBatch before the ClickHouse insert and is
+    flagged as inserted if the insert succeeded but the status update did not commit.
+    A retry receives the batch_id and skips the insert if it already happened, so a
+    failed status update never causes duplicate rows in ClickHouse. The batch is deleted once its logs are processed
+    or failed; a batch left behind after the retries run out is released by the
+    stale sweep after STALE_BATCH_AGE.
 
     Steps performed:
-    1. Marks stale messages (processing for more than 10 minutes) as failed.
-    2. Selects up to 500 pending or failed logs for processing.
-    3. Updates the status of the selected logs to 'processing'.
-    4. Inserts the logs into ClickHouse via EventLogClient.
-    5. Marks successfully processed logs as 'processed'.
-    6. Handles exceptions and logs errors, marking failed logs as 'failed'.
+    1. Releases stale messages (processing outside of any batch for more than 10 minutes,
+       or belonging to an abandoned batch), at most once per STALE_SWEEP_INTERVAL seconds.
+    2. Selects and locks up to OUTBOX_BATCH_SIZE pending or failed logs of the shard,
+       marks them as 'processing' and records the batch (steps 1-2 in one transaction).
+    3. Inserts the logs into ClickHouse via EventLogClient, unless the batch is already inserted.
+    4. Marks successfully processed logs as 'processed'. The update is sent to Postgres
+       while the ClickHouse insert is in flight and commits once the insert succeeds.
+    5. Retries the batch on transient errors; on other errors logs them and marks the logs as 'failed'.
     """
-    with start_transaction(op="task", name="process_outbox"):  # Start a transaction in Sentry for tracing
-        pending_logs_ids = []  # List to store the IDs of logs being processed
+    with (
+        start_transaction(op="task", name="process_outbox_shard"),  # Start a transaction in Sentry for tracing
+        # Bound once for the whole task, every log record below inherits it
+        structlog.contextvars.bound_contextvars(task='process_outbox_shard', shard_id=shard_id),
+    ):
+        if batch_id is not None:
+            retry_batch(self, batch_id, shard_id, num_shards)
+            return
 
-        try:
-            # 1. Handling stale records
-            stale_threshold = timezone.now() - timedelta(minutes=10)
-            with transaction.atomic():  # Ensure atomicity of database updates
-                # Mark records that are still processing for more than 10 minutes as failed
-                Outbox.objects.filter(
-                    status=Outbox.STATUS_PROCESSING,
-                    updated_at__lte=stale_threshold
-                ).update(status=Outbox.STATUS_FAILED)
-
-            # 2. Select records for processing (pending or failed)
-            pending_logs = list(Outbox.objects.filter(
-                status__in=[Outbox.STATUS_PENDING, Outbox.STATUS_FAILED]
-            ).order_by('created_at')[:500])  # Limit to 500 records to process at once
-
-            if not pending_logs:  # If no logs to process, exit early
+        with advisory_lock(shard_id) as acquired:
+            if not acquired:  # Another worker is already processing this shard
+                logger.info("Outbox shard is busy")
+                return
+
+            # 1-2. Sweep stale records and claim a batch (first of two commits)
+            batch, pending_logs = claim_batch(shard_id, num_shards)
+            if batch is None:  # If no logs to process, exit early
                 logger.info("No pending logs to process")
                 return
 
-            # Collect IDs of the logs to be updated
-            pending_logs_ids = [log.id for log in pending_logs]
+            process_batch(self, batch, shard_id, num_shards, pending_logs)
 
-            # 3. Update the status to 'processing'
-            with transaction.atomic():
-                Outbox.objects.filter(id__in=pending_logs_ids).update(
-                    status=Outbox.STATUS_PROCESSING,
-                    updated_at=timezone.now()  # Update the timestamp of when the processing started
-                )
 
-            # 4. Insert logs into ClickHouse (external service for storing logs)
-            with EventLogClient.init() as client:
-                client.insert(pending_logs)
+def retry_batch(task: Task, batch_id: str, shard_id: int, num_shards: int) -> None:
+    """
+    Resumes an already claimed batch: its records are owned by the batch, so no shard
+    lock is needed. A batch released by the stale sweep in the meantime is skipped.
+    """
+    batch = OutboxBatch.objects.filter(id=batch_id).first()
+    if batch is None:
+        logger.warning("Batch was released by the stale sweep, nothing to retry", batch_id=batch_id)
+        return
 
-            # 5. Mark logs as 'processed' upon successful completion
-            with transaction.atomic():
-                Outbox.objects.filter(id__in=pending_logs_ids).update(
-                    status=Outbox.STATUS_PROCESSED,
-                    updated_at=timezone.now()  # Update the timestamp to reflect successful processing
-                )
-                logger.info("Processed batch", size=len(pending_logs))  # Log the batch size
+    process_batch(task, batch, shard_id, num_shards)
+
+
+def process_batch(
+    task: Task,
+    batch: OutboxBatch,
+    shard_id: int,
+    num_shards: int,
+    pending_logs: list[dict[str, Any]] | None = None,
+) -> None:
+    """
+    Completes a claimed batch, retrying it on transient errors and failing its logs
+    on any other error. The logs are re-read from the database when not passed (i.e. on retry).
+    """
+    with structlog.contextvars.bound_contextvars(batch_id=str(batch.id)):
+        try:
+            complete_batch(batch, pending_logs)
+            logger.info("Processed batch", size=len(batch.outbox_ids))
+
+        except RETRYABLE_ERRORS as e:
+            # 5. Transient error: retry the same batch, its records stay claimed meanwhile
+            logger.warning("Processing interrupted, retrying batch", error=str(e))
+            raise task.retry(
+                exc=e,
+                args=(shard_id, num_shards),
+                kwargs={'batch_id': str(batch.id)},
+                countdown=60 * 2 ** task.request.retries,
+            ) from e
 
         except Exception as e:
-            # 6. Handle exceptions by logging error and updating failed logs
+            # 5. Logical error: log it and mark the logs as 'failed' to be picked up again
             logger.error("Processing failed", error=str(e))
-            if pending_logs_ids:  # If there were logs being processed, mark them as 'failed'
-                with transaction.atomic():
-                    Outbox.objects.filter(id__in=pending_logs_ids).update(
-                        status=Outbox.STATUS_FAILED,
-                        updated_at=timezone.now()  # Update timestamp for failed status
-                    )
+            release_batch(batch, Outbox.STATUS_FAILED)
             # Send the error message to Sentry for tracking
             capture_message(f"Outbox processing error: {str(e)}")
             raise  # Reraise the exception after logging and sending to Sentry
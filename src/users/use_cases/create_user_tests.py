@@ -55,7 +55,10 @@ def test_event_log_entry_published(
     )
 
     f_use_case.execute(request)
-    log = f_ch_client.query("SELECT * FROM default.event_log WHERE event_type = 'user_created'")
+    log = f_ch_client.query(
+        'SELECT event_type, event_date_time, environment, event_context, metadata_version '
+        "FROM default.event_log WHERE event_type = 'user_created'",
+    )
 
     assert log.result_rows == [
         (